@@ -1,182 +1,278 @@
-from flask import Flask, render_template, request, redirect
-import requests
+from flask import (
+    Flask, render_template, request, redirect, url_for, jsonify,
+    copy_current_request_context,
+)
+from flask_compress import Compress
+import hashlib
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from cachetools import TTLCache
+
+from fetching import (
+    MAX_PAGE_BYTES, FETCH_TIMEOUT, BlockedURL, PageTooLarge,
+    build_session, checked_get, read_capped, root_for,
+)
+from profiles import PROFILE_CSS, PROFILE_STYLE_BLOB, SCRIPT_FREE_PROFILES
+
+# Prefer the C-based lxml parser; fall back to the stdlib one for dev setups
+try:
+    import lxml.html
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Optional lexbor-backed parser, selectable via HTML_ENGINE for A/B runs
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
 
 app = Flask(__name__)
 
+# "regex" (splice, with bs4/lxml fallback) or "selectolax"
+app.config["HTML_ENGINE"] = os.environ.get("HTML_ENGINE", "regex")
+# Refuse to start rather than quietly A/B-testing the wrong engine
+if app.config["HTML_ENGINE"] not in ("regex", "selectolax"):
+    raise RuntimeError(f"Unknown HTML_ENGINE {app.config['HTML_ENGINE']!r}")
+if app.config["HTML_ENGINE"] == "selectolax" and LexborHTMLParser is None:
+    raise RuntimeError("HTML_ENGINE=selectolax but selectolax isn't installed")
+
+# scheme://host browsers reach us on (e.g. https://a11y.example.org behind a
+# TLS proxy). Unset → taken from each request's own Host header.
+app.config["PUBLIC_BASE_URL"] = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+
+# gzip/brotli text/html responses on the way back to the browser
+Compress(app)
+
 # -------------------------------------------------------------------
-# Accessibility profiles – all purely CSS, easy to demo
+# Shared HTTP session – keep-alive + connection pooling across previews
 # -------------------------------------------------------------------
-PROFILE_CSS = {
-    # 1. Low Vision – keep original colors/layout, just make it easier to see
-    "low_vision": """
-        html, body {
-            font-size: 18px !important;   /* default ~16px → 18px */
-        }
-        p, li, a, span, input, button, label {
-            font-size: 1.05em !important;
-            line-height: 1.8 !important;
-        }
-        body {
-            filter: contrast(1.15);       /* subtle contrast boost */
-        }
-        a {
-            text-decoration: underline !important;
-        }
-        a, button {
-            padding-top: 2px !important;
-            padding-bottom: 2px !important;
-        }
-        *:focus {
-            outline: 3px solid #facc15 !important;
-            outline-offset: 3px !important;
-        }
-    """,
-
-    # 2. Dyslexia – readable fonts + extra spacing
-    "dyslexia": """
-        * {
-            font-family: Arial, Verdana, sans-serif !important;
-        }
-        p, li {
-            letter-spacing: 0.06em !important;
-            word-spacing: 0.12em !important;
-            line-height: 1.8 !important;
-        }
-        p {
-            max-width: 60ch !important;   /* shorter line length */
-        }
-        body {
-            background-color: #f3f4f6 !important;
-            color: #111827 !important;
-        }
-    """,
-
-    # 3. ADHD – kill motion + obvious clutter
-    "adhd": """
-        * {
-            animation: none !important;
-            transition: none !important;
-        }
-        body {
-            background-color: #ffffff !important;
-            color: #111827 !important;
-        }
-        /* Hide common distraction containers */
-        [class*="banner"],
-        [class*="promo"],
-        [class*="carousel"],
-        [class*="slider"],
-        [class*="ads"],
-        [id*="ad"],
-        iframe {
-            display: none !important;
-        }
-        main, article, section {
-            max-width: 70rem !important;
-            margin-inline: auto !important;
-        }
-    """,
-
-    # 4. Autism / Sensory-Friendly – soften colors + layout breathing space
-    "autism": """
-        * {
-            animation: none !important;
-            transition: none !important;
-        }
-        body {
-            filter: saturate(0.75) brightness(1.02);
-        }
-        [class*="banner"],
-        [class*="promo"],
-        [class*="carousel"],
-        [class*="slider"] {
-            display: none !important;
-        }
-        section, article, main, nav {
-            margin-bottom: 1.6rem !important;
-        }
-        p, li {
-            line-height: 1.9 !important;
-        }
-    """,
-
-    # 5. Motor Disability – bigger click targets + clearer focus
-    "motor": """
-        a, button,
-        input[type="button"],
-        input[type="submit"],
-        input[type="reset"] {
-            min-height: 44px !important;   /* recommended by WCAG */
-            padding: 10px 18px !important;
-            font-size: 1.05em !important;
-            display: inline-flex !important;
-            align-items: center !important;
-            justify-content: center !important;
-        }
-        a + a, button + button {
-            margin-left: 8px !important;
-        }
-        *:focus {
-            outline: 3px solid #2563eb !important;
-            outline-offset: 3px !important;
-        }
-    """,
-
-    # 6. Elder / Easy-Read – bigger text + calm contrast
-    "elder": """
-        html, body {
-            font-size: 19px !important;
-        }
-        body {
-            background-color: #fdf6e3 !important; /* soft beige */
-            color: #111827 !important;
-        }
-        p, li {
-            line-height: 1.9 !important;
-        }
-        h1, h2, h3 {
-            font-weight: 700 !important;
-            margin-top: 1.2em !important;
-        }
-        a {
-            text-decoration: underline !important;
-        }
-    """,
-
-    # 7. Photosensitive / No-Motion – no animations, safe visuals
-    "photosensitive": """
-        *, *::before, *::after {
-            animation: none !important;
-            transition: none !important;
-        }
-        video[autoplay],
-        [class*="video-autoplay"],
-        [data-autoplay="true"] {
-            autoplay: false !important;
-        }
-        img[src$=".gif"],
-        [class*="gif"],
-        [class*="marquee"] {
-            animation: none !important;
-        }
-    """,
+# Use browser-like headers to bypass anti-bot protections
+BROWSER_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/124.0 Safari/537.36"
+    ),
 }
 
+SESSION = build_session(BROWSER_HEADERS)
+
+
+def reset_session() -> None:
+    """
+    Give this process its own connection pool. Called from gunicorn's
+    post_fork hook so preforked workers never share inherited sockets.
+    """
+    global SESSION
+    SESSION.close()
+    SESSION = build_session(BROWSER_HEADERS)
+
+
+# -------------------------------------------------------------------
+# Caches – skip the fetch + parse when the user just switches profile
+# -------------------------------------------------------------------
+# Both caches are bounded by the bytes they hold, not by entry count – a
+# few hundred 5 MB pages would otherwise pin gigabytes. Cached pages are
+# str, which CPython stores at 1-4 bytes per character, so they're
+# measured with sys.getsizeof rather than len.
+CACHE_BYTES = 64 * 1024 * 1024
+
+# url -> (etag, last_modified, raw_html), revalidated with conditional GETs
+PAGE_CACHE = TTLCache(
+    maxsize=CACHE_BYTES, ttl=300, getsizeof=lambda entry: sys.getsizeof(entry[2])
+)
+# (url, profile, public_root, etag, last_modified) -> rendered_bytes; a
+# refetched page with new validators simply misses, stale renders age out
+OUTPUT_CACHE = TTLCache(maxsize=CACHE_BYTES, ttl=300, getsizeof=len)
+_CACHE_LOCK = threading.Lock()
+
+# Shared pool for rendering several profiles of one page in parallel
+EXEC = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+
+# -------------------------------------------------------------------
+# Profile stylesheets – written to /static once so browsers cache them
+# -------------------------------------------------------------------
+# Safe app-wide only because this static folder holds nothing but the
+# generated, content-versioned profile CSS below
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 31536000
+
+# profile -> content hash, used as a cache-busting ?v= on the <link>
+PROFILE_CSS_VERSION = {}
+try:
+    _profiles_dir = os.path.join(app.static_folder, "profiles")
+    os.makedirs(_profiles_dir, exist_ok=True)
+    for key, css in PROFILE_CSS.items():
+        path = os.path.join(_profiles_dir, f"{key}.css")
+        data = css.encode("utf-8")
+        try:
+            with open(path, "rb") as fh:
+                unchanged = fh.read() == data
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            # Write aside and rename over, so a request racing this import
+            # (another worker, a restart) never sees a half-written file
+            # and caches it as immutable.
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        PROFILE_CSS_VERSION[key] = hashlib.blake2b(data, digest_size=8).hexdigest()
+except OSError:
+    # Read-only deploy → keep inlining the CSS
+    PROFILE_CSS_VERSION = {}
+
+
+def public_root() -> str:
+    """Origin that injected stylesheet links point back at."""
+    return app.config["PUBLIC_BASE_URL"] or request.host_url.rstrip("/")
+
+
+def profile_style_tag(profile: str) -> str:
+    """
+    <link> to the profile's cached stylesheet, or the inline <style> blob
+    when the stylesheet couldn't be written out.
+    """
+    version = PROFILE_CSS_VERSION.get(profile)
+    if version is None:
+        return PROFILE_STYLE_BLOB.get(profile, "")
+
+    # Absolute URL – the injected <base> would send a relative one to the target site
+    href = public_root() + url_for(
+        "static", filename=f"profiles/{profile}.css", v=version
+    )
+    return f'<link rel="stylesheet" href="{escape(href)}">'
+
+
+# Raw-markup patterns for the regex fast path
+HEAD_OPEN_RE = re.compile(r"<head\b[^>]*>", re.I)
+HEAD_CLOSE_RE = re.compile(r"</head\s*>", re.I)
+BASE_RE = re.compile(r"<base\b", re.I)
+SCRIPT_RE = re.compile(r"<script\b[^>]*>.*?</script\s*>", re.I | re.S)
+SCRIPT_OPEN_RE = re.compile(r"<script\b", re.I)
+
+
+def fast_inject(html: str, profile: str, root: str):
+    """
+    Same rewrite as apply_profile_css, done as string splices on the raw
+    markup instead of a full parse/serialize. Returns None when the page
+    has no explicit <head>…</head> (or has an unclosed <script> to strip),
+    so the caller can fall back to a parser.
+    """
+    if profile in SCRIPT_FREE_PROFILES:
+        html = SCRIPT_RE.sub("", html)
+        # An unclosed <script> swallows the rest of the page – let a real
+        # parser decide where it ends
+        if SCRIPT_OPEN_RE.search(html):
+            return None
+
+    head_open = HEAD_OPEN_RE.search(html)
+    if not head_open:
+        return None
+    head_close = HEAD_CLOSE_RE.search(html, head_open.end())
+    if not head_close:
+        return None
+
+    head = html[head_open.end():head_close.start()]
+    base = "" if BASE_RE.search(head) else f'<base href="{escape(root)}">'
+
+    return "".join((
+        html[:head_open.end()],
+        base,
+        head,
+        profile_style_tag(profile),
+        html[head_close.start():],
+    )).encode("utf-8")
+
+
+def strip_scripts_lxml(html: str, profile: str, root: str) -> bytes:
+    """
+    bs4-free rewrite for the script-stripping profiles: one XPath query and
+    C-level drop_tree() instead of find_all() + decompose() in Python.
+    """
+    doc = lxml.html.document_fromstring(html)
+
+    for script in doc.xpath("//script"):
+        script.drop_tree()
+
+    head = doc.find("head")
+    if head is None:
+        head = lxml.html.Element("head")
+        doc.insert(0, head)
+    if head.find("base") is None:
+        head.insert(0, lxml.html.Element("base", href=root))
+
+    style_tag = profile_style_tag(profile)
+    if style_tag:
+        head.append(lxml.html.fragment_fromstring(style_tag))
+
+    # libxml2 invents an HTML 4 doctype when there is none; only keep a real one
+    if html.lstrip()[:9].lower() == "<!doctype":
+        return lxml.html.tostring(doc.getroottree(), encoding="utf-8")
+    return lxml.html.tostring(doc, encoding="utf-8")
+
 
-def apply_profile_css(html: str, profile: str, original_url: str) -> str:
+def selectolax_inject(html: str, profile: str, root: str) -> bytes:
+    """
+    apply_profile_css on selectolax's lexbor parser, which doesn't build a
+    Python object per node. lexbor always synthesizes a <head>.
+    """
+    tree = LexborHTMLParser(html)
+    head = tree.head
+
+    if profile in SCRIPT_FREE_PROFILES:
+        for script in tree.css("script"):
+            script.decompose()
+
+    if head.css_first("base") is None:
+        base = LexborHTMLParser(f'<base href="{escape(root)}">').css_first("base")
+        if head.child is not None:
+            head.child.insert_before(base)
+        else:
+            head.insert_child(base)
+
+    style_tag = profile_style_tag(profile)
+    if style_tag:
+        head.insert_child(LexborHTMLParser(style_tag).css_first("link, style"))
+
+    return tree.html.encode("utf-8")
+
+
+def apply_profile_css(html: str, profile: str, original_url: str) -> bytes:
     """
     - Adds <base> so CSS/images load from the original website.
     - Optionally strips scripts (only for some profiles).
     - Injects the profile-specific CSS.
+    Returns UTF-8 bytes, ready to go straight into the response.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    root = root_for(original_url)
 
-    # 1) Base tag → fix /static/... 404 issues
-    parsed = urlparse(original_url)
-    root = f"{parsed.scheme}://{parsed.netloc}"
+    if app.config["HTML_ENGINE"] == "selectolax":
+        return selectolax_inject(html, profile, root)
+
+    # Common case: a well-formed <head> we can splice without parsing
+    output = fast_inject(html, profile, root)
+    if output is not None:
+        return output
+
+    if profile in SCRIPT_FREE_PROFILES and HTML_PARSER == "lxml":
+        try:
+            return strip_scripts_lxml(html, profile, root)
+        except (lxml.etree.ParserError, ValueError):
+            # e.g. a comment-only document, or an <?xml encoding=…?> prolog
+            # on a str – bs4 copes with both
+            pass
 
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    # 1) Base tag → fix /static/... 404 issues
     if soup.head:
         if not soup.head.find("base"):
             base_tag = soup.new_tag("base", href=root)
@@ -188,16 +284,56 @@ def apply_profile_css(html: str, profile: str, original_url: str) -> str:
         soup.insert(0, head)
 
     # 2) Only strip scripts for ADHD + Photosensitive (to reduce distractions)
-    if profile in ("adhd", "photosensitive"):
+    if profile in SCRIPT_FREE_PROFILES:
         for script in soup.find_all("script"):
             script.decompose()
 
-    # 3) Inject our CSS
-    style_tag = soup.new_tag("style")
-    style_tag.string = PROFILE_CSS.get(profile, "")
-    soup.head.append(style_tag)
+    # 3) Inject our CSS – spliced into the serialized output, not the tree
+    output = soup.encode("utf-8")
+    return output.replace(
+        b"</head>", profile_style_tag(profile).encode("utf-8") + b"</head>", 1
+    )
+
+
+def fetch_page(url: str):
+    """
+    Fetch a page, revalidating any cached copy with If-None-Match /
+    If-Modified-Since. Returns (status_code, html, version) where `version`
+    is the (etag, last_modified) pair the body is cached under, or None if
+    the page can't be revalidated and so isn't cached.
+    """
+    with _CACHE_LOCK:
+        cached = PAGE_CACHE.get(url)
+
+    headers = {}
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    with checked_get(
+        SESSION, url, headers=headers, timeout=FETCH_TIMEOUT, stream=True
+    ) as resp:
+        if resp.status_code == 304 and cached:
+            return 200, cached[2], cached[:2]
+
+        if resp.status_code >= 400:
+            return resp.status_code, None, None
+
+        html = read_capped(resp)
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+
+    if not (etag or last_modified):
+        with _CACHE_LOCK:
+            PAGE_CACHE.pop(url, None)
+        return resp.status_code, html, None
 
-    return str(soup)
+    with _CACHE_LOCK:
+        PAGE_CACHE[url] = (etag, last_modified, html)
+    return resp.status_code, html, (etag, last_modified)
 
 
 # -------------------------------------------------------------------
@@ -208,23 +344,36 @@ def index():
     return render_template("index.html")
 
 
+@app.after_request
+def mark_profile_css_immutable(response):
+    # Profile stylesheets are content-versioned, so they never change in place
+    if request.path.startswith(f"{app.static_url_path}/profiles/"):
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
 @app.route("/preview", methods=["POST"])
 def preview():
     url = request.form.get("url")
     profile = request.form.get("profile")
 
-    # Use browser-like headers to bypass anti-bot protections
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/124.0 Safari/537.36"
-        )
-    }
-
-    # Fetch page
+    # Fetch page (conditional GET when we already have a copy). Junk and
+    # internal URLs – including redirects to them – are refused up front.
     try:
-        resp = requests.get(url, headers=headers, timeout=12)
+        status, html, version = fetch_page(url)
+    except BlockedURL:
+        return """
+            <h2 style='font-family: system-ui'>This URL can't be previewed</h2>
+            <p>Enter a full public address starting with http:// or https://
+            (e.g. https://example.com/article).</p>
+        """
+    except PageTooLarge:
+        return f"""
+            <h2 style='font-family: system-ui'>This page is too large to preview</h2>
+            <p>We only preview pages up to {MAX_PAGE_BYTES // (1024 * 1024)} MB of HTML.
+            Try a lighter page (an article, docs page, etc.).</p>
+        """
     except Exception as e:
         return f"""
             <h2 style='font-family: system-ui'>Could not load URL</h2>
@@ -234,20 +383,65 @@ def preview():
         """
 
     # Handle HTTP errors (418, 403, 404, etc.)
-    if resp.status_code >= 400:
+    if status >= 400:
         return f"""
             <h2 style='font-family: system-ui'>This website blocked our preview</h2>
-            <p>Status code: {resp.status_code}</p>
+            <p>Status code: {status}</p>
             <p>Some websites (e.g., IEEE, banking portals, paywalled sites) 
             block automated tools.  
             Try a public site like docs or blogs.</p>
         """
 
+    # Same page version + profile we've already rendered → serve it directly
+    # The rendered page embeds public_root(), so it's part of the key too
+    key = (url, profile, public_root()) + version if version else None
+    if key:
+        with _CACHE_LOCK:
+            cached = OUTPUT_CACHE.get(key)
+        if cached is not None:
+            return cached
+
     # Inject accessibility CSS
-    html = resp.text
-    html = apply_profile_css(html, profile, url)
+    body = apply_profile_css(html, profile, url)
+
+    # Only worth keeping if the page itself can be revalidated later
+    if key:
+        with _CACHE_LOCK:
+            OUTPUT_CACHE[key] = body
+
+    return body
 
-    return html
+
+@app.route("/preview/all", methods=["POST"])
+def preview_all():
+    """
+    Fetch the page once and render every profile in parallel, returning
+    {profile: html} – handy for side-by-side thumbnails in the UI.
+    """
+    url = request.form.get("url")
+
+    try:
+        status, html, _ = fetch_page(url)
+    except BlockedURL:
+        return jsonify(error="URL must be a public http(s) address"), 400
+    except PageTooLarge:
+        return jsonify(error="Page is too large to preview"), 413
+    except Exception as e:
+        return jsonify(error=f"Could not load URL: {e}"), 502
+
+    if status >= 400:
+        return jsonify(error=f"Upstream returned status {status}"), 502
+
+    # Each job gets its own copy of the request context (url_for needs one)
+    futures = {
+        profile: EXEC.submit(
+            copy_current_request_context(apply_profile_css), html, profile, url
+        )
+        for profile in PROFILE_CSS
+    }
+    return jsonify({
+        profile: f.result().decode("utf-8") for profile, f in futures.items()
+    })
 
 
 
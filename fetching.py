@@ -0,0 +1,184 @@
+"""
+Upstream fetching for app.py: pooled sessions, URL pre-flight checks,
+size-capped reads and charset handling. web/ keeps its own copy so that app
+runs standalone.
+"""
+import codecs
+import http.cookiejar
+import ipaddress
+import re
+import socket
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# (connect, read). Together with the retry policy in build_session, an
+# unreachable host gives up after ~6.5 s (two 3.05 s connects + backoff) and
+# a slow one after at most ~18.5 s per request (one connect retry, one 12 s
+# read – read timeouts are never retried).
+FETCH_TIMEOUT = (3.05, 12)
+
+# Pages bigger than this are refused rather than buffered into memory
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+
+# Only plain http(s) URLs with a hostname are worth a fetch attempt
+URL_RE = re.compile(r"^https?://[A-Za-z0-9.\-]+(?::\d+)?([/?#].*)?$")
+
+# Redirects are followed by hand so every hop goes through is_allowed_url
+MAX_REDIRECTS = 5
+
+
+class BlockedURL(Exception):
+    """Raised when a URL or one of its redirect targets isn't public http(s)."""
+
+
+def _is_public(address: str) -> bool:
+    try:
+        return ipaddress.ip_address(address).is_global
+    except ValueError:
+        return False
+
+
+class _PublicOnlyConnection:
+    """
+    Checks the address the socket actually connected to, before any bytes
+    are sent – DNS may answer differently here than it did for
+    is_allowed_url, and urllib3 tries every A/AAAA record in turn.
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        if not _is_public(sock.getpeername()[0]):
+            sock.close()
+            raise BlockedURL(self.host)
+        return sock
+
+
+class _PublicHTTPConnection(_PublicOnlyConnection, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnlyConnection, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class _PublicOnlyAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools only ever connect to public addresses."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PublicHTTPPool,
+            "https": _PublicHTTPSPool,
+        }
+
+
+def build_session(headers: dict) -> requests.Session:
+    """Session with a keep-alive connection pool shared across previews."""
+    session = requests.Session()
+    adapter = _PublicOnlyAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        # Retry a failed connect once; never re-send after a read timeout
+        max_retries=Retry(total=2, connect=1, read=0, backoff_factor=0.3),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    # Shared across users, so never keep one target site's Set-Cookie for
+    # the next preview (requests stores them even on unfollowed redirects)
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    session.headers.update(headers)
+    # Compressed upstream transfers (brotli decoding needs `brotli`)
+    session.headers["Accept-Encoding"] = "br, gzip"
+    return session
+
+
+@lru_cache(maxsize=1024)
+def root_for(url: str) -> str:
+    """scheme://host of a URL – memoized since the same page is re-previewed."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def is_allowed_url(url: str) -> bool:
+    """
+    Cheap pre-flight check before fetching: a well-formed http(s) URL whose
+    host resolves only to public addresses (no localhost / private networks)
+    – every A and AAAA record, since the connection may use any of them.
+    """
+    if not url or not URL_RE.match(url):
+        return False
+    parsed = urlparse(url)
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError):
+        return False
+    return bool(infos) and all(_is_public(info[4][0]) for info in infos)
+
+
+def checked_get(session: requests.Session, url: str, **kwargs):
+    """
+    session.get() that follows redirects itself and re-runs is_allowed_url
+    on every hop, so a public page can't bounce the fetch to an internal
+    address. Returns the final response; the caller closes it. Sessions
+    from build_session also re-check the connected address itself.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        if not is_allowed_url(url):
+            raise BlockedURL(url)
+        resp = session.get(url, allow_redirects=False, **kwargs)
+        if not resp.is_redirect:
+            return resp
+        url = urljoin(url, resp.headers["Location"])
+        resp.close()
+    raise requests.TooManyRedirects(f"Exceeded {MAX_REDIRECTS} redirects")
+
+
+class PageTooLarge(Exception):
+    """Raised when an upstream page exceeds MAX_PAGE_BYTES."""
+
+
+def response_encoding(resp) -> str:
+    """
+    Charset from the Content-Type header, else UTF-8 – never sniffed, and
+    not requests' ISO-8859-1 default for text/* without a charset.
+    """
+    content_type = resp.headers.get("Content-Type", "").lower()
+    if "charset" in content_type and resp.encoding:
+        try:
+            return codecs.lookup(resp.encoding).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def read_capped(resp) -> str:
+    """
+    Read a streamed response body, refusing anything over MAX_PAGE_BYTES
+    so a huge page never gets fully buffered.
+    """
+    length = resp.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > MAX_PAGE_BYTES:
+        raise PageTooLarge()
+
+    body = resp.raw.read(MAX_PAGE_BYTES + 1, decode_content=True)
+    if len(body) > MAX_PAGE_BYTES:
+        raise PageTooLarge()
+
+    return body.decode(response_encoding(resp), errors="replace")
@@ -0,0 +1,26 @@
+# gunicorn.conf.py – production server for app.py
+#   gunicorn -c gunicorn.conf.py
+import multiprocessing
+
+wsgi_app = "app:app"
+bind = "0.0.0.0:8000"
+
+# Previews are mostly waiting on upstream I/O, so threads per worker
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = "gthread"
+threads = 8
+
+# Import app.py (and write the profile stylesheets) once in the master
+preload_app = True
+
+# gthread workers heartbeat from their main loop, so this only reaps a wedged
+# worker, not a slow preview. Still leave room for a fetch: up to ~18.5 s per
+# request (see FETCH_TIMEOUT in fetching.py), times each redirect hop.
+timeout = 60
+
+
+def post_fork(server, worker):
+    # The master's Session must not be shared across forks – each worker
+    # gets its own warm keep-alive pool
+    import app
+    app.reset_session()
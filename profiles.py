@@ -0,0 +1,170 @@
+"""
+Accessibility profiles – all purely CSS, easy to demo.
+
+Kept in one module so the dict and everything precomputed from it are built
+once per process, however many entry points import it.
+"""
+
+PROFILE_CSS = {
+    # 1. Low Vision – keep original colors/layout, just make it easier to see
+    "low_vision": """
+        html, body {
+            font-size: 18px !important;   /* default ~16px → 18px */
+        }
+        p, li, a, span, input, button, label {
+            font-size: 1.05em !important;
+            line-height: 1.8 !important;
+        }
+        body {
+            filter: contrast(1.15);       /* subtle contrast boost */
+        }
+        a {
+            text-decoration: underline !important;
+        }
+        a, button {
+            padding-top: 2px !important;
+            padding-bottom: 2px !important;
+        }
+        *:focus {
+            outline: 3px solid #facc15 !important;
+            outline-offset: 3px !important;
+        }
+    """,
+
+    # 2. Dyslexia – readable fonts + extra spacing
+    "dyslexia": """
+        * {
+            font-family: Arial, Verdana, sans-serif !important;
+        }
+        p, li {
+            letter-spacing: 0.06em !important;
+            word-spacing: 0.12em !important;
+            line-height: 1.8 !important;
+        }
+        p {
+            max-width: 60ch !important;   /* shorter line length */
+        }
+        body {
+            background-color: #f3f4f6 !important;
+            color: #111827 !important;
+        }
+    """,
+
+    # 3. ADHD – kill motion + obvious clutter
+    "adhd": """
+        * {
+            animation: none !important;
+            transition: none !important;
+        }
+        body {
+            background-color: #ffffff !important;
+            color: #111827 !important;
+        }
+        /* Hide common distraction containers */
+        [class*="banner"],
+        [class*="promo"],
+        [class*="carousel"],
+        [class*="slider"],
+        [class*="ads"],
+        [id*="ad"],
+        iframe {
+            display: none !important;
+        }
+        main, article, section {
+            max-width: 70rem !important;
+            margin-inline: auto !important;
+        }
+    """,
+
+    # 4. Autism / Sensory-Friendly – soften colors + layout breathing space
+    "autism": """
+        * {
+            animation: none !important;
+            transition: none !important;
+        }
+        body {
+            filter: saturate(0.75) brightness(1.02);
+        }
+        [class*="banner"],
+        [class*="promo"],
+        [class*="carousel"],
+        [class*="slider"] {
+            display: none !important;
+        }
+        section, article, main, nav {
+            margin-bottom: 1.6rem !important;
+        }
+        p, li {
+            line-height: 1.9 !important;
+        }
+    """,
+
+    # 5. Motor Disability – bigger click targets + clearer focus
+    "motor": """
+        a, button,
+        input[type="button"],
+        input[type="submit"],
+        input[type="reset"] {
+            min-height: 44px !important;   /* recommended by WCAG */
+            padding: 10px 18px !important;
+            font-size: 1.05em !important;
+            display: inline-flex !important;
+            align-items: center !important;
+            justify-content: center !important;
+        }
+        a + a, button + button {
+            margin-left: 8px !important;
+        }
+        *:focus {
+            outline: 3px solid #2563eb !important;
+            outline-offset: 3px !important;
+        }
+    """,
+
+    # 6. Elder / Easy-Read – bigger text + calm contrast
+    "elder": """
+        html, body {
+            font-size: 19px !important;
+        }
+        body {
+            background-color: #fdf6e3 !important; /* soft beige */
+            color: #111827 !important;
+        }
+        p, li {
+            line-height: 1.9 !important;
+        }
+        h1, h2, h3 {
+            font-weight: 700 !important;
+            margin-top: 1.2em !important;
+        }
+        a {
+            text-decoration: underline !important;
+        }
+    """,
+
+    # 7. Photosensitive / No-Motion – no animations, safe visuals
+    "photosensitive": """
+        *, *::before, *::after {
+            animation: none !important;
+            transition: none !important;
+        }
+        video[autoplay],
+        [class*="video-autoplay"],
+        [data-autoplay="true"] {
+            autoplay: false !important;
+        }
+        img[src$=".gif"],
+        [class*="gif"],
+        [class*="marquee"] {
+            animation: none !important;
+        }
+    """,
+}
+
+# Ready-to-splice <style> blocks, built once at import
+PROFILE_STYLE_BLOB = {
+    key: f"<style>{css}</style>" for key, css in PROFILE_CSS.items()
+}
+
+# Profiles that also drop every <script> (to reduce distractions)
+SCRIPT_FREE_PROFILES = ("adhd", "photosensitive")
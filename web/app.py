@@ -1,33 +1,153 @@
 # app.py
-from flask import Flask, request, render_template, Response
-import requests
-from bs4 import BeautifulSoup
+from flask import Flask, request, render_template, Response, url_for
+from flask_compress import Compress
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urlparse
+import hashlib
 import os
+import re
+
+from fetching import (
+    FETCH_TIMEOUT, BlockedURL, PageTooLarge, build_session, checked_get, read_capped,
+    root_for,
+)
+
+# Prefer the C-based lxml parser; fall back to the stdlib one for dev setups
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
+# scheme://host browsers reach us on; unset → the request's own Host header
+app.config['PUBLIC_BASE_URL'] = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')
+
+# Compress proxied HTML on the way back to the browser
+Compress(app)
+
+# Pooled keep-alive session so repeated previews reuse connections
+SESSION = build_session({'User-Agent': 'a11y-simulator/1.0'})
 
 # Load CSS we will inject into proxied pages
 PROFILE_CSS_PATH = os.path.join(app.static_folder or 'static', 'profiles.css')
 if os.path.exists(PROFILE_CSS_PATH):
     with open(PROFILE_CSS_PATH, 'r', encoding='utf-8') as fh:
         PROFILE_CSS = fh.read()
+    # Content hash for a cache-busting ?v= on the injected <link>
+    PROFILE_CSS_VERSION = hashlib.blake2b(PROFILE_CSS.encode(), digest_size=8).hexdigest()
 else:
     PROFILE_CSS = "/* profile css file not found */"
+    PROFILE_CSS_VERSION = None
+
+# Raw <head> is edited by string splices; only the <body> start tag is parsed
+HEAD_OPEN_RE = re.compile(r'<head\b[^>]*>', re.I)
+HEAD_CLOSE_RE = re.compile(r'</head\s*>', re.I)
+BASE_TAG_RE = re.compile(r'<base\b[^>]*>', re.I)
+BODY_OPEN_RE = re.compile(r'<body\b[^>]*>', re.I)
+BODY_ONLY = SoupStrainer('body')
 
 @app.route('/')
 def index():
     """Serve the front-end UI (templates/index.html)."""
     return render_template('index.html')
 
-def sanitize_and_inject(html_text: str, original_base: str, profile_key: str) -> str:
+@app.after_request
+def _cache_profile_css(response):
+    # Only profiles.css is content-versioned (?v=); other static UI assets
+    # keep Flask's default so a deploy isn't hidden behind year-old copies
+    if request.path == f'{app.static_url_path}/profiles.css' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 31536000
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+def _base_tag(soup, original_base: str):
+    return soup.new_tag('base', href=original_base)
+
+def _profile_style_tag(soup):
+    # Link the (browser-cached) profile stylesheet; inline it only if missing.
+    # The href is absolute since the injected <base> points at the target site.
+    if PROFILE_CSS_VERSION:
+        root = app.config['PUBLIC_BASE_URL'] or request.host_url.rstrip('/')
+        href = root + url_for('static', filename='profiles.css', v=PROFILE_CSS_VERSION)
+        return soup.new_tag('link', id='a11y-profile', rel='stylesheet', href=href)
+    style_tag = soup.new_tag('style', id='a11y-profile')
+    style_tag.string = PROFILE_CSS
+    return style_tag
+
+def _inject_head(soup, head, original_base: str) -> None:
+    """Insert/replace the <base> tag and append the profile <style> to head."""
+    # Insert or replace <base href="...">
+    base_tag = _base_tag(soup, original_base)
+    existing = head.find('base')
+    if existing:
+        existing.replace_with(base_tag)
+    else:
+        head.insert(0, base_tag)
+
+    head.append(_profile_style_tag(soup))
+
+def _apply_profile_class(body, profile_key: str) -> None:
+    """Remove any existing profile-* classes and add the requested one."""
+    existing_classes = list(body.get('class', []))
+    existing_classes = [c for c in existing_classes if not c.startswith('profile-')]
+    if profile_key:
+        existing_classes.append(profile_key)
+    if existing_classes:
+        body['class'] = existing_classes
+
+def _splice_head_and_body(html_text: str, original_base: str, profile_key: str):
+    """
+    Fast path for sanitize_and_inject: splice <base> and the profile <style>
+    into the raw <head> and parse only the <body> start tag; everything else
+    passes through untouched. Returns None if head or body can't be located.
+    """
+    head_open = HEAD_OPEN_RE.search(html_text)
+    if not head_open:
+        return None
+    head_close = HEAD_CLOSE_RE.search(html_text, head_open.end())
+    if not head_close:
+        return None
+    body_match = BODY_OPEN_RE.search(html_text, head_close.end())
+    if not body_match:
+        return None
+
+    body_soup = BeautifulSoup(body_match.group(0), HTML_PARSER, parse_only=BODY_ONLY)
+    if body_soup.body is None:
+        return None
+
+    _apply_profile_class(body_soup.body, profile_key)
+    # The parsed start tag comes back as an empty element; keep the open tag
+    body_open = str(body_soup.body)[:-len('</body>')]
+
+    # Any existing <base> is replaced by ours, placed first in <head>
+    head = BASE_TAG_RE.sub('', html_text[head_open.end():head_close.start()])
+
+    return ''.join((
+        html_text[:head_open.end()],
+        str(_base_tag(body_soup, original_base)),
+        head,
+        str(_profile_style_tag(body_soup)),
+        html_text[head_close.start():body_match.start()],
+        body_open,
+        html_text[body_match.end():],
+    )).encode('utf-8')
+
+def sanitize_and_inject(html_text: str, original_base: str, profile_key: str) -> bytes:
     """
     Parse the fetched HTML and inject:
       - a <base> tag so relative resources point to the original site
-      - a <style id="a11y-profile"> containing PROFILE_CSS
+      - a <link id="a11y-profile"> to PROFILE_CSS (or an inline <style>)
       - a class on <body> that activates the chosen profile (e.g. profile-dyslexic)
+    Returns UTF-8 bytes, ready to go straight into the response.
     """
-    soup = BeautifulSoup(html_text, 'html.parser')
+    spliced = _splice_head_and_body(html_text, original_base, profile_key)
+    if spliced is not None:
+        return spliced
+
+    soup = BeautifulSoup(html_text, HTML_PARSER)
 
     # Ensure there's a <head>
     if soup.head is None:
@@ -36,18 +156,7 @@ def sanitize_and_inject(html_text: str, original_base: str, profile_key: str) ->
     else:
         head = soup.head
 
-    # Insert or replace <base href="...">
-    base_tag = soup.new_tag('base', href=original_base)
-    existing = head.find('base')
-    if existing:
-        existing.replace_with(base_tag)
-    else:
-        head.insert(0, base_tag)
-
-    # Add the style block with profile CSS
-    style_tag = soup.new_tag('style', id='a11y-profile')
-    style_tag.string = PROFILE_CSS
-    head.append(style_tag)
+    _inject_head(soup, head, original_base)
 
     # Ensure a <body> exists and add profile class
     if soup.body is None:
@@ -56,17 +165,10 @@ def sanitize_and_inject(html_text: str, original_base: str, profile_key: str) ->
         for element in list(soup.contents):
             body.append(element.extract())
         soup.append(body)
-    body = soup.body
 
-    # Remove any existing profile-* classes and add the requested one
-    existing_classes = list(body.get('class', []))
-    existing_classes = [c for c in existing_classes if not c.startswith('profile-')]
-    if profile_key:
-        existing_classes.append(profile_key)
-    if existing_classes:
-        body['class'] = existing_classes
+    _apply_profile_class(soup.body, profile_key)
 
-    return str(soup)
+    return soup.encode('utf-8')
 
 @app.route('/fetch')
 def fetch_and_modify():
@@ -82,19 +184,23 @@ def fetch_and_modify():
         return "Missing 'url' parameter", 400
 
     # Normalize URL: add http if missing
-    parsed = urlparse(target)
-    if not parsed.scheme:
+    if not urlparse(target).scheme:
         target = 'http://' + target
-        parsed = urlparse(target)
 
+    # Junk / internal URLs (and redirects to them) are refused before fetching
     try:
-        resp = requests.get(target, timeout=12, headers={'User-Agent': 'a11y-simulator/1.0'})
-        resp.raise_for_status()
+        with checked_get(SESSION, target, timeout=FETCH_TIMEOUT, stream=True) as resp:
+            resp.raise_for_status()
+            html_text = read_capped(resp)
+    except BlockedURL:
+        return "URL must be a public http(s) address", 400
+    except PageTooLarge:
+        return "Target page is too large to preview", 413
     except Exception as e:
         return f"Error fetching target URL: {e}", 502
 
-    base = f"{parsed.scheme}://{parsed.netloc}"
-    modified = sanitize_and_inject(resp.text, base, profile)
+    base = root_for(target)
+    modified = sanitize_and_inject(html_text, base, profile)
     return Response(modified, headers={'Content-Type': 'text/html; charset=utf-8'})
 
 if __name__ == '__main__':